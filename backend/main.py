@@ -1,15 +1,61 @@
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import base64
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import logging
 import os
 import tempfile
+import threading
+import aiofiles
+import h5py
 import mne
 import numpy as np
+import orjson
+import pandas as pd
+from pydantic import BaseModel
 import scipy.io
-from scipy.signal import butter, filtfilt, iirnotch
+from scipy.signal import butter, iirnotch, sosfilt, sosfilt_zi, sosfiltfilt, tf2sos
 
-app = FastAPI()
+try:
+    from numba import njit
+except ImportError:  # optional; clean_eeg falls back to SciPy's sosfiltfilt
+    njit = None
+
+# Only this module's level; handlers and the root logger belong to the server
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+# Above this many samples (channels x samples) /parse leaves the array out of
+# the JSON body and points at /download instead.
+MAX_SAMPLES_INLINE = int(os.environ.get("MAX_SAMPLES_INLINE", 1_000_000))
+# Arrays /parse persists for /clean and /download: a .npy plus a .json of
+# recording metadata per opaque token, least recently used evicted above the cap
+DATA_DIR = os.environ.get("DATA_DIR", os.path.join(tempfile.gettempdir(), "neuroflow-data"))
+DATA_MAX_BYTES = int(os.environ.get("DATA_MAX_BYTES", 2 << 30))
+# /clean results are memoized on disk, oldest-first eviction above the size cap
+CLEAN_CACHE_DIR = os.environ.get("CLEAN_CACHE_DIR", os.path.join(tempfile.gettempdir(), "neuroflow-clean-cache"))
+CLEAN_CACHE_MAX_BYTES = int(os.environ.get("CLEAN_CACHE_MAX_BYTES", 512 << 20))
+# Part of every cache key; bump whenever clean_eeg's output changes so results
+# computed by older code (the cache survives restarts) are not served.
+CLEAN_CACHE_VERSION = 2
+
+# sosfiltfilt (and the Numba kernel) release the GIL, so channels filter in parallel
+_FILTER_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson, which encodes ndarrays natively."""
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,8 +63,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Data-Shape", "X-Data-Dtype", "X-Sampling-Rate", "X-Warnings"],
 )
 
+# --- Request models ---
+class ParseRequest(BaseModel):
+    tmp_path: str | None = None
+    binary: bool = False  # return data as base64 float32 instead of a JSON list
+
+class CleanRequest(BaseModel):
+    """Body of /clean: a data_token or tmp_path, or the samples inline."""
+    data_token: str | None = None  # from /parse
+    tmp_path: str | None = None
+    # Shape and element type are checked in the endpoint so bad input gets the
+    # documented 400 rather than a validation 422
+    data: list | None = None
+    cleaned_data: list | None = None
+    preview: list | None = None
+    data_b64: str | None = None  # base64 little-endian samples, as /parse returns them
+    dtype: str = "float32"
+    shape: list[int] | None = None
+    sampling_rate: float | None = None  # 256 for inline data; a data_token or tmp_path carries its own
+    channels: int | None = None
+    channel_names: list[str] | None = None
+    duration_sec: float | None = None
+    bandpass_low: float | None = None
+    bandpass_high: float | None = None
+    lowpass_freq: float | None = None
+    highpass_freq: float | None = None
+    notch_freq: float | None = 50
+    zero_phase: bool = True  # False: single causal pass, half the work but phase-shifted
+
 # --- FastAPI Endpoints ---
 @app.get("/health")
 def health():
@@ -29,193 +104,564 @@ async def upload_eeg(file: UploadFile = File(...)):
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in [".edf", ".csv", ".mat"]:
         raise HTTPException(status_code=400, detail="Unsupported file format")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-        content = await file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
+    fd, tmp_path = tempfile.mkstemp(suffix=ext)
+    os.close(fd)
+    # Stream the body to disk so large uploads never sit fully in memory
+    async with aiofiles.open(tmp_path, 'wb') as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await out.write(chunk)
     return {"filename": file.filename, "tmp_path": tmp_path}
 
-@app.post("/parse")
-async def parse_eeg(payload: dict = Body(...)):
-    tmp_path = payload.get("tmp_path")
-    if not tmp_path:
-        raise HTTPException(status_code=400, detail="Missing tmp_path")
+def _load_array(tmp_path):
+    """Read an uploaded recording into a float32 (channels x samples) array.
+
+    Returns the array and a metadata dict with channels, sampling_rate,
+    duration_sec and channel_names. Blocking; run it off the event loop.
+    """
     ext = os.path.splitext(tmp_path)[1].lower()
-    try:
-        if ext == ".edf":
-            raw = mne.io.read_raw_edf(tmp_path, preload=True)
-            data = raw.get_data()
-            channels = raw.info['nchan']
-            sampling_rate = int(raw.info['sfreq'])
-            duration_sec = int(raw.times[-1])
-            channel_names = raw.ch_names
-        elif ext == ".csv":
-            arr = np.loadtxt(tmp_path, delimiter=',')
-            channels = arr.shape[0]
-            samples = arr.shape[1]
-            sampling_rate = 256  # Assume default, update as needed
-            duration_sec = samples // sampling_rate
-            channel_names = [f"Ch{i+1}" for i in range(channels)]
-            data = arr
-        elif ext == ".mat":
-            mat = scipy.io.loadmat(tmp_path)
+    if ext == ".edf":
+        # Without preload, get_data() decodes straight into the result
+        # instead of first filling MNE's internal buffer and copying it out.
+        raw = mne.io.read_raw_edf(tmp_path, preload=False)
+        data = raw.get_data()
+        channels = raw.info['nchan']
+        sampling_rate = int(raw.info['sfreq'])
+        duration_sec = int(raw.times[-1])
+        channel_names = raw.ch_names
+    elif ext == ".csv":
+        # C tokenizer; rows are channels, columns are samples
+        try:
+            arr = pd.read_csv(tmp_path, header=None, dtype=np.float32, engine='c').to_numpy()
+            # read_csv pads short rows and trailing commas with NaN; leave
+            # those files to loadtxt, which rejects them
+            if np.isnan(arr).any():
+                raise ValueError("missing fields")
+        except (ValueError, pd.errors.ParserError):
+            # Slow path for files the C parser rejects (e.g. odd whitespace)
+            arr = np.loadtxt(tmp_path, delimiter=',', dtype=np.float32, ndmin=2)
+        channels = arr.shape[0]
+        samples = arr.shape[1]
+        sampling_rate = 256  # Assume default, update as needed
+        duration_sec = samples // sampling_rate
+        channel_names = [f"Ch{i+1}" for i in range(channels)]
+        data = arr
+    elif ext == ".mat":
+        if scipy.io.matlab.matfile_version(tmp_path)[0] == 2:
+            # v7.3 files are HDF5: read only the 'data' dataset, which
+            # MATLAB stores column-major, hence the transpose.
+            with h5py.File(tmp_path, 'r') as f:
+                if 'data' not in f:
+                    raise Exception("No 'data' key in .mat file")
+                arr = f['data'][()].T
+        else:
+            mat = scipy.io.loadmat(tmp_path, variable_names=['data'])
             arr = mat.get('data')
             if arr is None:
                 raise Exception("No 'data' key in .mat file")
-            channels = arr.shape[0]
-            samples = arr.shape[1]
-            sampling_rate = 256  # Assume default, update as needed
-            duration_sec = samples // sampling_rate
-            channel_names = [f"Ch{i+1}" for i in range(channels)]
-            data = arr
-        else:
-            raise Exception("Unsupported file format")
-        preview = data[:, :min(10, data.shape[1])].tolist()
-        return JSONResponse(content={
-            "channels": channels,
-            "sampling_rate": sampling_rate,
-            "duration_sec": duration_sec,
-            "data_shape": [channels, data.shape[1]],
-            "channel_names": channel_names,
-            "preview": preview,
-            "data": data.tolist()
-        })
+        channels = arr.shape[0]
+        samples = arr.shape[1]
+        sampling_rate = 256  # Assume default, update as needed
+        duration_sec = samples // sampling_rate
+        channel_names = [f"Ch{i+1}" for i in range(channels)]
+        data = arr
+    else:
+        raise Exception("Unsupported file format")
+    meta = {
+        "channels": channels,
+        "sampling_rate": sampling_rate,
+        "duration_sec": duration_sec,
+        "channel_names": channel_names,
+    }
+    return np.ascontiguousarray(data, dtype=np.float32), meta
+
+def _data_file(token, suffix=".npy"):
+    """Path of a file behind a /parse data_token, or None if malformed."""
+    if len(token) != 32 or any(c not in "0123456789abcdef" for c in token):
+        return None
+    return os.path.join(DATA_DIR, f"{token}{suffix}")
+
+def _write_atomic(path, write):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+def _save_data(tmp_path, data, meta):
+    """Persist data and its recording metadata under DATA_DIR; return the token.
+
+    The token is a digest of the upload's path and version, so parsing the
+    same file again reuses the array already on disk.
+    """
+    st = os.stat(tmp_path)
+    key = repr((os.path.realpath(tmp_path), st.st_mtime_ns, st.st_size)).encode()
+    token = hashlib.blake2b(key, digest_size=16).hexdigest()
+    path = _data_file(token)
+    meta_path = _data_file(token, ".json")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if not os.path.exists(meta_path):
+        _write_atomic(meta_path, lambda f: f.write(orjson.dumps(meta)))
+    if os.path.exists(path):
+        os.utime(path)  # mark as recently used
+    else:
+        _write_atomic(path, lambda f: np.save(f, data))
+    _evict_oldest(DATA_DIR, DATA_MAX_BYTES, keep=path)
+    return token
+
+def _open_data(token):
+    """Memory-map the array behind a data_token; returns (data, meta) or None."""
+    path = _data_file(token)
+    if path is None:
+        return None
+    try:
+        with open(_data_file(token, ".json"), 'rb') as f:
+            meta = orjson.loads(f.read())
+        data = np.load(path, mmap_mode='r')
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return data, meta
+
+def _byte_chunks(arr, chunk_size=1 << 16):
+    """Yield the raw bytes of a C-contiguous array in chunk_size slices."""
+    buf = memoryview(arr).cast("B")
+    for start in range(0, len(buf), chunk_size):
+        yield bytes(buf[start:start + chunk_size])
+
+def _ndjson_stream(meta, data):
+    """Metadata on the first line, then one JSON array per channel."""
+    yield orjson.dumps(meta, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+    for row in data:
+        yield orjson.dumps(row, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+
+@app.post("/parse")
+async def parse_eeg(request: Request, req: ParseRequest):
+    tmp_path = req.tmp_path
+    if not tmp_path:
+        raise HTTPException(status_code=400, detail="Missing tmp_path")
+    try:
+        data, info = await asyncio.to_thread(_load_array, tmp_path)
+        # Persist the array so /clean can memory-map it instead of receiving
+        # it back as a JSON list.
+        data_token = await asyncio.to_thread(_save_data, tmp_path, data, info)
+        preview_samples = min(10, data.shape[1])
+        meta = {
+            "channels": info["channels"],
+            "sampling_rate": info["sampling_rate"],
+            "duration_sec": info["duration_sec"],
+            "data_shape": [info["channels"], data.shape[1]],
+            "channel_names": info["channel_names"],
+            "data_token": data_token,
+            "dtype": "float32",
+            "shape": list(data.shape),
+            "preview_samples": preview_samples,
+        }
+        # Large recordings can be streamed channel by channel instead of
+        # materialising the whole array as one JSON document.
+        if "application/x-ndjson" in request.headers.get("accept", ""):
+            return StreamingResponse(_ndjson_stream(meta, data), media_type="application/x-ndjson")
+        if data.size > MAX_SAMPLES_INLINE:
+            # The samples are not inline, so ship the first few for display.
+            # orjson needs C-contiguous arrays, which a column slice is not.
+            preview = np.ascontiguousarray(data[:, :preview_samples])
+            return ORJSONResponse(content={**meta, "preview": preview, "data_url": f"/download/{data_token}"})
+        if req.binary:
+            # Little-endian float32, row-major (channels x samples)
+            data_b64 = base64.b64encode(data.tobytes()).decode("ascii")
+            return ORJSONResponse(content={**meta, "data_b64": data_b64})
+        return ORJSONResponse(content={**meta, "data": data})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def bandpass_filter(data, lowcut, highcut, fs, order=4):
+@app.get("/download/{token}")
+def download_data(token: str):
+    """Serve the float32 .npy that /parse wrote for an upload."""
+    path = _data_file(token)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Unknown data token")
+    os.utime(path)
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{token}.npy")
+
+def _map_channels(fn, data, out=None):
+    """Apply fn(row, out_row) to every channel on the filter pool."""
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    if out is None:
+        out = np.empty_like(data)
+    if data.shape[0] == 1:
+        fn(data[0], out[0])
+    else:
+        list(_FILTER_POOL.map(fn, data, out))
+    return out
+
+def _sos_padlen(sos):
+    # sosfiltfilt's default edge padding for a cascade of len(sos) sections
+    return 3 * (2 * len(sos) + 1)
+
+def _frozen(sos):
+    # The lru_cache'd designs below hand every caller the same array; make
+    # it read-only so no caller can corrupt later filters.
+    sos.flags.writeable = False
+    return sos
+
+@lru_cache(maxsize=128)
+def _butter_band(fs, lowcut, highcut, order):
     nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    padlen = 3 * max(len(a), len(b))
-    if data.shape[1] <= padlen:
-        return data
-    return filtfilt(b, a, data, axis=1)
+    return _frozen(butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos'))
+
+@lru_cache(maxsize=128)
+def _butter_low(fs, cutoff, order):
+    nyq = 0.5 * fs
+    return _frozen(butter(order, cutoff / nyq, btype='low', output='sos'))
+
+@lru_cache(maxsize=128)
+def _butter_high(fs, cutoff, order):
+    nyq = 0.5 * fs
+    return _frozen(butter(order, cutoff / nyq, btype='high', output='sos'))
 
-def lowpass_filter(data, cutoff, fs, order=4):
+@lru_cache(maxsize=128)
+def _iirnotch(fs, notch_freq, quality):
     nyq = 0.5 * fs
-    normal_cutoff = cutoff / nyq
-    b, a = butter(order, normal_cutoff, btype='low')
-    padlen = 3 * max(len(a), len(b))
+    return _frozen(tf2sos(*iirnotch(notch_freq / nyq, quality)))
+
+def bandpass_filter(data, lowcut, highcut, fs, order=4, zero_phase=True):
+    sos = _butter_band(fs, lowcut, highcut, order)
+    if not zero_phase:
+        return _causal(sos, data)
+    padlen = _sos_padlen(sos)
     if data.shape[1] <= padlen:
         return data
-    return filtfilt(b, a, data, axis=1)
+    return _zero_phase(sos, data, padlen)
 
-def highpass_filter(data, cutoff, fs, order=4):
-    nyq = 0.5 * fs
-    normal_cutoff = cutoff / nyq
-    b, a = butter(order, normal_cutoff, btype='high')
-    padlen = 3 * max(len(a), len(b))
+def lowpass_filter(data, cutoff, fs, order=4, zero_phase=True):
+    sos = _butter_low(fs, cutoff, order)
+    if not zero_phase:
+        return _causal(sos, data)
+    padlen = _sos_padlen(sos)
     if data.shape[1] <= padlen:
         return data
-    return filtfilt(b, a, data, axis=1)
+    return _zero_phase(sos, data, padlen)
 
-def notch_filter(data, notch_freq, fs, quality=30):
-    nyq = 0.5 * fs
-    freq = notch_freq / nyq
-    b, a = iirnotch(freq, quality)
-    padlen = 3 * max(len(a), len(b))
+def highpass_filter(data, cutoff, fs, order=4, zero_phase=True):
+    sos = _butter_high(fs, cutoff, order)
+    if not zero_phase:
+        return _causal(sos, data)
+    padlen = _sos_padlen(sos)
     if data.shape[1] <= padlen:
         return data
-    return filtfilt(b, a, data, axis=1)
+    return _zero_phase(sos, data, padlen)
 
-def baseline_correction(data):
-    return data - np.mean(data, axis=1, keepdims=True)
+def notch_filter(data, notch_freq, fs, quality=30, zero_phase=True):
+    sos = _iirnotch(fs, notch_freq, quality)
+    if not zero_phase:
+        return _causal(sos, data)
+    padlen = _sos_padlen(sos)
+    if data.shape[1] <= padlen:
+        return data
+    return _zero_phase(sos, data, padlen)
 
-def clean_eeg(
-    data,
+@lru_cache(maxsize=128)
+def _cascade_sos(
     fs,
     bandpass_low=None,
     bandpass_high=None,
     lowpass_freq=None,
     highpass_freq=None,
-    notch_freq=50
+    notch_freq=None,
+    order=4,
+    quality=30
 ):
-    filtered = data.copy()
-    # Bandpass
+    """Every enabled stage of the clean_eeg chain as one SOS cascade, or None."""
+    sos_list = []
     if bandpass_low is not None and bandpass_high is not None:
-        filtered = bandpass_filter(filtered, bandpass_low, bandpass_high, fs)
-    # Highpass
+        sos_list.append(_butter_band(fs, bandpass_low, bandpass_high, order))
     if highpass_freq is not None:
-        filtered = highpass_filter(filtered, highpass_freq, fs)
-    # Lowpass
+        sos_list.append(_butter_high(fs, highpass_freq, order))
     if lowpass_freq is not None:
-        filtered = lowpass_filter(filtered, lowpass_freq, fs)
-    # Notch (always apply)
+        sos_list.append(_butter_low(fs, lowpass_freq, order))
     if notch_freq is not None:
-        filtered = notch_filter(filtered, notch_freq, fs)
-    # Baseline correction (always apply)
-    filtered = baseline_correction(filtered)
-    return filtered
+        sos_list.append(_iirnotch(fs, notch_freq, quality))
+    if not sos_list:
+        return None
+    # Kept in float64: rounding low-cutoff sections to float32 can push their
+    # poles onto the unit circle. Only the samples are stored as float32.
+    return _frozen(np.vstack(sos_list))
+
+if njit is not None:
+    # nogil rather than parallel=True: channels are spread over _FILTER_POOL
+    # like the SciPy path, which avoids Numba's threading-layer caveats when
+    # several requests filter at once.
+    @njit(nogil=True, fastmath=True, cache=True)
+    def _sosfiltfilt_nb(sos, zi, x, padlen, out):
+        """sosfiltfilt of a single row into out: odd-extended, forward then
+        reverse, all sections fused into one pass over the samples. The
+        recurrence runs in float64 whatever the dtype of x and out."""
+        n = x.shape[0]
+        nsec = sos.shape[0]
+        m = n + 2 * padlen
+        buf = np.empty(m, dtype=np.float64)
+        for i in range(n):
+            buf[padlen + i] = x[i]
+        first = buf[padlen]
+        last = buf[padlen + n - 1]
+        for i in range(padlen):
+            buf[i] = 2 * first - buf[2 * padlen - i]
+            buf[padlen + n + i] = 2 * last - buf[padlen + n - 2 - i]
+        state = np.empty((nsec, 2), dtype=np.float64)
+        for direction in range(2):
+            start = 0 if direction == 0 else m - 1
+            step = 1 if direction == 0 else -1
+            x0 = buf[start]
+            for k in range(nsec):
+                state[k, 0] = zi[k, 0] * x0
+                state[k, 1] = zi[k, 1] * x0
+            i = start
+            for _ in range(m):
+                v = buf[i]
+                for k in range(nsec):
+                    y = sos[k, 0] * v + state[k, 0]
+                    state[k, 0] = sos[k, 1] * v - sos[k, 4] * y + state[k, 1]
+                    state[k, 1] = sos[k, 2] * v - sos[k, 5] * y
+                    v = y
+                buf[i] = v
+                i += step
+        for i in range(n):
+            out[i] = buf[padlen + i]
+
+def _zero_phase(sos, data, padlen, out=None):
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    sos = np.array(sos)  # SciPy's filter loops reject read-only buffers
+    if njit is not None:
+        zi = sosfilt_zi(sos)
+        def run(row, out_row):
+            _sosfiltfilt_nb(sos, zi, row, padlen, out_row)
+    else:
+        def run(row, out_row):
+            out_row[:] = sosfiltfilt(sos, row, padlen=padlen)
+    return _map_channels(run, data, out)
+
+def _causal(sos, data, out=None):
+    """Single forward sosfilt pass, started in steady state at each row's
+    first sample so there is no step transient."""
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    sos = np.array(sos)  # SciPy's filter loops reject read-only buffers
+    zi = sosfilt_zi(sos)
+    def run(row, out_row):
+        out_row[:], _ = sosfilt(sos, row, zi=zi * row[0])
+    return _map_channels(run, data, out)
+
+# sosfiltfilt's padlen for a 4th-order Butterworth; shorter inputs are not filtered
+MIN_FILTER_LEN = 27
+
+def _short_input_warnings(n_samples, zero_phase=True):
+    if zero_phase and n_samples <= MIN_FILTER_LEN:
+        return [f"Filtering skipped: data length ({n_samples}) <= padlen ({MIN_FILTER_LEN})"]
+    return []
+
+def baseline_correction(data):
+    """Subtract the per-channel mean in place and return `data`."""
+    mean = np.mean(data, axis=1, dtype=np.float32, keepdims=True)
+    np.subtract(data, mean, out=data)
+    return data
+
+def clean_eeg(
+    data,
+    fs,
+    bandpass_low=None,
+    bandpass_high=None,
+    lowpass_freq=None,
+    highpass_freq=None,
+    notch_freq=50,
+    zero_phase=True
+):
+    """Filter and baseline-correct `data`; returns (cleaned, warnings)."""
+    # Unit-stride rows so every per-channel pass reads samples sequentially;
+    # a no-op for the float32 arrays /clean already passes in.
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    # One output buffer for the whole chain: the filter pass writes into it
+    # and the baseline is removed in place, so the input is never modified.
+    out = np.empty_like(data)
+    warnings = _short_input_warnings(data.shape[1], zero_phase)
+    # Bandpass, highpass, lowpass and notch fused into a single zero-phase
+    # pass; the stages are LTI so cascading them is equivalent to chaining.
+    sos = _cascade_sos(fs, bandpass_low, bandpass_high, lowpass_freq, highpass_freq, notch_freq)
+    if sos is None or warnings or data.shape[1] == 0:
+        # Nothing to filter: write the baseline-corrected input straight to out
+        np.subtract(data, np.mean(data, axis=1, dtype=np.float32, keepdims=True), out=out)
+    elif not zero_phase:
+        _causal(sos, data, out=out)
+        baseline_correction(out)
+    else:
+        # Same padding rule as sosfiltfilt's default, clipped for short inputs
+        padlen = min(_sos_padlen(sos), data.shape[1] - 1)
+        _zero_phase(sos, data, padlen, out=out)
+        # Baseline correction (always apply)
+        baseline_correction(out)
+    return out, warnings
+
+def _evict_oldest(directory, max_bytes, keep=None):
+    """Delete the least recently used .npy files in directory (and any .json
+    beside them) until the .npy files total at most max_bytes."""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(".npy") and entry.path != keep:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:  # evicted by a concurrent request
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None:
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        for victim in (path, path[:-len(".npy")] + ".json"):
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+def _cached_clean(data, fs, **params):
+    """clean_eeg memoized on disk by (input samples, fs, filter params).
+
+    Only the samples are stored; the warnings depend on the shape alone and
+    are rebuilt on a hit.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((CLEAN_CACHE_VERSION, data.shape, fs, sorted(params.items()))).encode())
+    h.update(memoryview(data))
+    path = os.path.join(CLEAN_CACHE_DIR, h.hexdigest() + ".npy")
+    try:
+        cleaned = np.load(path)
+        os.utime(path)  # mark as recently used
+        return cleaned, _short_input_warnings(data.shape[1], params.get("zero_phase", True))
+    except (OSError, ValueError):
+        pass
+    cleaned, warnings = clean_eeg(data, fs, **params)
+    os.makedirs(CLEAN_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, cleaned)
+    os.replace(tmp, path)
+    _evict_oldest(CLEAN_CACHE_DIR, CLEAN_CACHE_MAX_BYTES)
+    return cleaned, warnings
 
 
 @app.post("/clean")
-async def clean_eeg_endpoint(payload: dict = Body(...)):
+async def clean_eeg_endpoint(request: Request, req: CleanRequest):
     """
     Clean EEG signal with bandpass, lowpass, highpass, notch, and baseline correction.
     Accepts parsed JSON from /parse or similar structure, or file path.
-    Returns cleaned EEG JSON.
+    Returns cleaned EEG JSON, or raw float32 bytes (shape/dtype in the
+    X-Data-* headers) when the client sends Accept: application/octet-stream.
     """
     try:
-        # Accepts either a tmp_path (file) or direct data
-        if 'tmp_path' in payload:
-            # Reuse parse logic
-            parse_resp = await parse_eeg(payload)
-            parsed = parse_resp.body if hasattr(parse_resp, 'body') else parse_resp
-            if isinstance(parsed, bytes):
-                import json
-                parsed = json.loads(parsed.decode())
+        # Accepts a data_token (.npy from /parse), a tmp_path (file), base64 or direct data
+        channels = req.channels
+        channel_names = req.channel_names
+        duration_sec = req.duration_sec
+        fs = req.sampling_rate
+        if req.data_token:
+            opened = await asyncio.to_thread(_open_data, req.data_token)
+            if opened is None:
+                return ORJSONResponse(status_code=404, content={"error": "Unknown data_token"})
+            data, info = opened
+            # The token carries the recording's metadata; fields sent in the
+            # request take precedence.
+            if channels is None:
+                channels = info["channels"]
+            if channel_names is None:
+                channel_names = info["channel_names"]
+            if duration_sec is None:
+                duration_sec = info["duration_sec"]
+            if fs is None:
+                fs = info["sampling_rate"]
+        elif req.tmp_path:
+            # Load the file directly; no JSON round-trip through /parse
+            data, info = await asyncio.to_thread(_load_array, req.tmp_path)
+            channels = info["channels"]
+            channel_names = info["channel_names"]
+            duration_sec = info["duration_sec"]
+            fs = info["sampling_rate"]
+        elif req.data_b64:
+            # Decoding raw bytes skips building and walking nested JSON lists
+            if req.dtype not in ("float32", "float64"):
+                return ORJSONResponse(status_code=400, content={"error": f"Unsupported dtype {req.dtype!r}"})
+            try:
+                raw = base64.b64decode(req.data_b64, validate=True)
+                data = np.frombuffer(raw, dtype=np.dtype(req.dtype).newbyteorder("<"))
+            except (binascii.Error, ValueError) as e:
+                return ORJSONResponse(status_code=400, content={"error": f"Invalid data_b64: {e}"})
+            if req.shape is not None:
+                if np.prod(req.shape) != data.size:
+                    return ORJSONResponse(status_code=400, content={"error": f"data_b64 holds {data.size} values, which does not match shape {req.shape}"})
+                data = data.reshape(req.shape)
         else:
-            parsed = payload
-        import sys
-        print("[DEBUG] Received payload:", payload, file=sys.stderr)
-        print("[DEBUG] Parsed object:", parsed, file=sys.stderr)
-        data = np.array(parsed.get('preview') or parsed.get('data') or parsed.get('cleaned_data'))
-        print("[DEBUG] Data shape before reshape:", data.shape, file=sys.stderr)
+            src = next((d for d in (req.data, req.cleaned_data, req.preview) if d), None)
+            if src is None:
+                return ORJSONResponse(status_code=400, content={"error": "No EEG data provided"})
+            try:
+                data = np.asarray(src, dtype=np.float32)
+            except (TypeError, ValueError):
+                return ORJSONResponse(status_code=400, content={"error": "Input data must be a numeric (channels x samples) array"})
+        fs = int(fs) if fs is not None else 256
+        logger.debug("clean input shape=%s fs=%s", data.shape, fs)
         # Ensure data is 2D (channels x samples)
         if data.ndim == 1:
             data = data.reshape(1, -1)
-            print("[DEBUG] Data reshaped to:", data.shape, file=sys.stderr)
         elif data.ndim != 2:
-            print("[DEBUG] Invalid data shape:", data.shape, file=sys.stderr)
-            return JSONResponse(status_code=400, content={"error": f"Input data must be 2D (channels x samples), got shape {data.shape}"})
-        fs = int(parsed.get('sampling_rate', 256))
-        channels = int(parsed.get('channels', data.shape[0]))
-        channel_names = parsed.get('channel_names', [f"Ch{i+1}" for i in range(channels)])
-        duration_sec = int(parsed.get('duration_sec', data.shape[1] // fs))
+            logger.debug("rejecting clean input with shape=%s", data.shape)
+            return ORJSONResponse(status_code=400, content={"error": f"Input data must be 2D (channels x samples), got shape {data.shape}"})
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if channels is None:
+            channels = data.shape[0]
+        if channel_names is None:
+            channel_names = [f"Ch{i+1}" for i in range(channels)]
+        duration_sec = int(duration_sec if duration_sec is not None else data.shape[1] // fs)
 
         # Get filter params from body
-        bandpass_low = payload.get('bandpass_low')
-        bandpass_high = payload.get('bandpass_high')
-        lowpass_freq = payload.get('lowpass_freq')
-        highpass_freq = payload.get('highpass_freq')
-        notch_freq = payload.get('notch_freq', 50)
-
-        warnings = []
-        # Check if filtering will be skipped due to short data
-        padlen = 27  # Conservative default for 4th order Butterworth
-        if data.shape[1] <= padlen:
-            warnings.append(f"Filtering skipped: data length ({data.shape[1]}) <= padlen ({padlen})")
-        cleaned = clean_eeg(
+        bandpass_low = req.bandpass_low
+        bandpass_high = req.bandpass_high
+        lowpass_freq = req.lowpass_freq
+        highpass_freq = req.highpass_freq
+        notch_freq = req.notch_freq
+
+        cleaned, warnings = await asyncio.to_thread(
+            _cached_clean,
             data,
             fs,
             bandpass_low=bandpass_low,
             bandpass_high=bandpass_high,
             lowpass_freq=lowpass_freq,
             highpass_freq=highpass_freq,
-            notch_freq=notch_freq
+            notch_freq=notch_freq,
+            zero_phase=req.zero_phase
         )
+        if "application/octet-stream" in request.headers.get("accept", ""):
+            cleaned = np.ascontiguousarray(cleaned, dtype=np.float32)
+            headers = {
+                "X-Data-Shape": ",".join(str(n) for n in cleaned.shape),
+                "X-Data-Dtype": "float32",
+                "X-Sampling-Rate": str(fs),
+            }
+            if warnings:
+                headers["X-Warnings"] = "; ".join(warnings)
+            return StreamingResponse(
+                _byte_chunks(cleaned),
+                media_type="application/octet-stream",
+                headers=headers,
+            )
         response = {
             "channels": channels,
             "sampling_rate": fs,
             "duration_sec": duration_sec,
             "data_shape": [channels, data.shape[1]],
             "channel_names": channel_names,
-            "cleaned_data": cleaned.tolist()
+            "cleaned_data": cleaned
         }
         if warnings:
             response["warnings"] = warnings
-        return JSONResponse(content=response)
+        return ORJSONResponse(content=response)
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return ORJSONResponse(status_code=500, content={"error": str(e)})
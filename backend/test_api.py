@@ -0,0 +1,233 @@
+import base64
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+import main
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(main, "CLEAN_CACHE_DIR", str(tmp_path / "clean-cache"))
+    return TestClient(main.app)
+
+
+def _upload(client, name, body):
+    r = client.post("/upload", files={"file": (name, body)})
+    assert r.status_code == 200
+    return r.json()["tmp_path"]
+
+
+def test_parse_csv(client):
+    tmp_path = _upload(client, "x.csv", b"1,2,3\n4,5,6\n")
+    r = client.post("/parse", json={"tmp_path": tmp_path})
+    assert r.status_code == 200
+    assert r.json()["data"] == [[1, 2, 3], [4, 5, 6]]
+
+
+@pytest.mark.parametrize("body", [
+    b"1,2,3,\n4,5,6,\n",  # trailing comma
+    b"1,2,3\n4,5\n",      # ragged
+])
+def test_parse_csv_rejects_missing_fields(client, body):
+    tmp_path = _upload(client, "x.csv", body)
+    r = client.post("/parse", json={"tmp_path": tmp_path})
+    assert r.status_code == 500
+    assert "row" in r.json()["detail"]
+
+
+def test_clean_data_token_uses_recording_metadata(client):
+    tmp_path = _upload(client, "x.csv", b"0\n")  # only gives the token a file to key on
+    data = np.random.default_rng(0).standard_normal((2, 1600)).astype(np.float32)
+    meta = {"channels": 2, "sampling_rate": 160, "duration_sec": 10, "channel_names": ["C3", "C4"]}
+    token = main._save_data(tmp_path, data, meta)
+    r = client.post("/clean", json={"data_token": token, "notch_freq": 60})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["sampling_rate"] == 160
+    assert body["channel_names"] == ["C3", "C4"]
+    expected, _ = main.clean_eeg(data, 160, notch_freq=60)
+    np.testing.assert_allclose(body["cleaned_data"], expected, rtol=1e-6, atol=1e-6)
+    # Fields in the request still win
+    assert client.post("/clean", json={"data_token": token, "sampling_rate": 200}).json()["sampling_rate"] == 200
+
+
+def test_data_dir_evicts_least_recently_used(client, monkeypatch):
+    data = np.zeros((1, 1000), dtype=np.float32)
+    monkeypatch.setattr(main, "DATA_MAX_BYTES", 2 * data.nbytes + 512)
+    meta = {"channels": 1, "sampling_rate": 256, "duration_sec": 3, "channel_names": ["Ch1"]}
+    tokens = [main._save_data(_upload(client, "x.csv", b"0\n"), data, meta) for _ in range(3)]
+    assert client.get(f"/download/{tokens[0]}").status_code == 404
+    assert not os.path.exists(main._data_file(tokens[0], ".json"))
+    for token in tokens[1:]:
+        assert client.get(f"/download/{token}").status_code == 200
+
+
+@pytest.mark.parametrize("zero_phase", [True, False])
+def test_clean_empty_rows(client, zero_phase):
+    r = client.post("/clean", json={"data": [[]], "zero_phase": zero_phase})
+    assert r.status_code == 200
+    assert r.json()["cleaned_data"] == [[]]
+
+
+@pytest.mark.parametrize("data, error", [
+    ([[[1.0, 2.0]], [[3.0, 4.0]]], "must be 2D"),
+    ([[1.0, 2.0], [3.0]], "numeric"),
+    ([["a", "b"]], "numeric"),
+])
+def test_clean_rejects_bad_inline_data(client, data, error):
+    r = client.post("/clean", json={"data": data})
+    assert r.status_code == 400
+    assert error in r.json()["error"]
+
+
+def _b64(arr):
+    return base64.b64encode(np.ascontiguousarray(arr).tobytes()).decode("ascii")
+
+
+def test_clean_data_b64_matches_inline(client):
+    data = np.random.default_rng(1).standard_normal((2, 500)).astype(np.float32)
+    inline = client.post("/clean", json={"data": data.tolist()}).json()["cleaned_data"]
+    for dtype in ("float32", "float64"):
+        r = client.post("/clean", json={"data_b64": _b64(data.astype(dtype)), "dtype": dtype, "shape": [2, 500]})
+        assert r.status_code == 200
+        assert r.json()["cleaned_data"] == inline
+
+
+@pytest.mark.parametrize("body", [
+    {"data_b64": "AAAA="},                                      # bad padding
+    {"data_b64": "!!!!"},                                       # not base64
+    {"data_b64": "AAAA"},                                       # 3 bytes, not a whole float32
+    {"data_b64": "AAAAAA==", "dtype": "int32"},                 # unsupported dtype
+    {"data_b64": _b64(np.zeros(6, np.float32)), "shape": [4, 2]},
+])
+def test_clean_data_b64_rejects_bad_input(client, body):
+    r = client.post("/clean", json=body)
+    assert r.status_code == 400
+    assert "error" in r.json()
+
+
+def test_clean_causal(client):
+    data = np.random.default_rng(2).standard_normal((2, 1000)).astype(np.float32)
+    params = {"bandpass_low": 1, "bandpass_high": 40, "notch_freq": None}
+    causal = client.post("/clean", json={"data": data.tolist(), "zero_phase": False, **params}).json()
+    zero_phase = client.post("/clean", json={"data": data.tolist(), **params}).json()
+    assert "warnings" not in causal
+    sos = butter(4, [1 / 128, 40 / 128], btype='band', output='sos')
+    ref = np.stack([sosfilt(sos, row, zi=sosfilt_zi(sos) * row[0])[0] for row in data.astype(np.float64)])
+    ref -= ref.mean(axis=1, keepdims=True)
+    np.testing.assert_allclose(causal["cleaned_data"], ref, atol=1e-5)
+    assert not np.allclose(causal["cleaned_data"], zero_phase["cleaned_data"], atol=1e-3)
+
+
+@pytest.mark.parametrize("token", ["nope", "0" * 32, "..%2F..%2Fetc%2Fpasswd", "A" * 32])
+def test_unknown_or_malformed_tokens(client, token):
+    assert client.get(f"/download/{token}").status_code == 404
+    r = client.post("/clean", json={"data_token": token.replace("%2F", "/")})
+    assert r.status_code == 404
+    assert r.json() == {"error": "Unknown data_token"}
+
+
+def test_parse_data_token_round_trip(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_SAMPLES_INLINE", 4)
+    tmp_path = _upload(client, "x.csv", b"1,2,3\n4,5,6\n")
+    body = client.post("/parse", json={"tmp_path": tmp_path}).json()
+    assert "data" not in body
+    assert body["preview"] == [[1, 2, 3], [4, 5, 6]]
+    r = client.get(body["data_url"])
+    assert r.status_code == 200
+    np.testing.assert_array_equal(np.load(io.BytesIO(r.content)), [[1, 2, 3], [4, 5, 6]])
+    r = client.post("/clean", json={"data_token": body["data_token"], "notch_freq": None})
+    assert r.json()["cleaned_data"] == [[-1, 0, 1], [-1, 0, 1]]
+
+
+def test_parse_ndjson(client):
+    tmp_path = _upload(client, "x.csv", b"1,2,3\n4,5,6\n")
+    r = client.post("/parse", json={"tmp_path": tmp_path}, headers={"Accept": "application/x-ndjson"})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines[0]["shape"] == [2, 3]
+    assert "data" not in lines[0]
+    assert lines[1:] == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_clean_octet_stream(client):
+    data = np.random.default_rng(3).standard_normal((3, 400)).astype(np.float32)
+    as_json = client.post("/clean", json={"data": data.tolist(), "sampling_rate": 200}).json()
+    r = client.post("/clean", json={"data": data.tolist(), "sampling_rate": 200},
+                    headers={"Accept": "application/octet-stream"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/octet-stream"
+    assert r.headers["x-data-shape"] == "3,400"
+    assert r.headers["x-data-dtype"] == "float32"
+    assert r.headers["x-sampling-rate"] == "200"
+    cleaned = np.frombuffer(r.content, dtype="<f4").reshape(3, 400)
+    np.testing.assert_array_equal(cleaned, np.asarray(as_json["cleaned_data"], dtype=np.float32))
+
+
+def _cache_files():
+    return sorted(os.listdir(main.CLEAN_CACHE_DIR))
+
+
+def test_clean_cache_hit_and_miss(client, monkeypatch):
+    data = np.random.default_rng(4).standard_normal((2, 300)).astype(np.float32).tolist()
+    first = client.post("/clean", json={"data": data}).json()
+    assert len(_cache_files()) == 1
+
+    clean_eeg = main.clean_eeg
+    def fail(*args, **kwargs):
+        raise AssertionError("clean_eeg ran on a cache hit")
+    monkeypatch.setattr(main, "clean_eeg", fail)
+    assert client.post("/clean", json={"data": data}).json() == first
+    monkeypatch.setattr(main, "clean_eeg", clean_eeg)
+
+    # Different parameters or a new implementation version are misses
+    client.post("/clean", json={"data": data, "notch_freq": 60})
+    assert len(_cache_files()) == 2
+    monkeypatch.setattr(main, "CLEAN_CACHE_VERSION", main.CLEAN_CACHE_VERSION + 1)
+    client.post("/clean", json={"data": data})
+    assert len(_cache_files()) == 3
+
+
+def test_clean_cache_evicts_oldest(client, monkeypatch):
+    shape = (1, 1000)
+    entry_bytes = 4 * shape[1] + 128  # float32 samples plus the .npy header
+    monkeypatch.setattr(main, "CLEAN_CACHE_MAX_BYTES", 2 * entry_bytes)
+    rng = np.random.default_rng(5)
+    inputs = [rng.standard_normal(shape).astype(np.float32).tolist() for _ in range(3)]
+    written = []
+    for data in inputs:
+        client.post("/clean", json={"data": data})
+        written.append(next(f for f in _cache_files() if f not in written))
+    assert _cache_files() == sorted(written[1:])
+    # Evicted results are simply recomputed
+    assert client.post("/clean", json={"data": inputs[0]}).status_code == 200
+
+
+def test_clean_cache_tolerates_concurrent_eviction(client, monkeypatch):
+    os.makedirs(main.CLEAN_CACHE_DIR)
+    open(os.path.join(main.CLEAN_CACHE_DIR, "gone.npy"), "wb").close()
+    real_scandir = os.scandir
+
+    class VanishingScandir:
+        # Lists gone.npy, then deletes it before the caller can stat it
+        def __init__(self, path):
+            self._it = real_scandir(path)
+
+        def __enter__(self):
+            entries = list(self._it)
+            os.remove(os.path.join(main.CLEAN_CACHE_DIR, "gone.npy"))
+            return iter(entries)
+
+        def __exit__(self, *exc):
+            self._it.close()
+
+    monkeypatch.setattr(main.os, "scandir", VanishingScandir)
+    r = client.post("/clean", json={"data": [[1.0, 2.0, 3.0]]})
+    assert r.status_code == 200
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy.signal import butter, iirnotch, sosfiltfilt, tf2sos
+
+import main
+
+
+def _reference(data, fs, bandpass_low=None, bandpass_high=None, lowpass_freq=None,
+               highpass_freq=None, notch_freq=None):
+    """float64 sosfiltfilt over the filters designed straight from SciPy,
+    then baseline correction."""
+    nyq = 0.5 * fs
+    stages = []
+    if bandpass_low is not None and bandpass_high is not None:
+        stages.append(butter(4, [bandpass_low / nyq, bandpass_high / nyq], btype='band', output='sos'))
+    if highpass_freq is not None:
+        stages.append(butter(4, highpass_freq / nyq, btype='high', output='sos'))
+    if lowpass_freq is not None:
+        stages.append(butter(4, lowpass_freq / nyq, btype='low', output='sos'))
+    if notch_freq is not None:
+        stages.append(tf2sos(*iirnotch(notch_freq / nyq, 30)))
+    ref = sosfiltfilt(np.vstack(stages), data.astype(np.float64), axis=1)
+    return ref - ref.mean(axis=1, keepdims=True)
+
+
+@pytest.fixture(params=["numba", "scipy"])
+def backend(request, monkeypatch):
+    if request.param == "numba":
+        if main.njit is None:
+            pytest.skip("numba is not installed")
+    else:
+        monkeypatch.setattr(main, "njit", None)
+    return request.param
+
+
+@pytest.mark.parametrize("fs, params", [
+    (256, dict(bandpass_low=1, bandpass_high=40, highpass_freq=0.5, lowpass_freq=45, notch_freq=50)),
+    (1000, dict(bandpass_low=0.1, bandpass_high=40, notch_freq=50)),
+    # Low cutoff at a high rate: poles sit right next to the unit circle
+    (5000, dict(bandpass_low=0.1, bandpass_high=40, notch_freq=50)),
+])
+def test_clean_eeg_matches_float64_sosfiltfilt(backend, fs, params):
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((3, 10 * fs)).astype(np.float32)
+    cleaned, warnings = main.clean_eeg(data, fs, **params)
+    ref = _reference(data, fs, **params)
+    assert cleaned.dtype == np.float32
+    assert warnings == []
+    assert np.abs(cleaned - ref).max() <= 1e-5 * np.abs(ref).max()
+
+
+def test_cached_coefficients_are_read_only():
+    sos = main._cascade_sos(256, 1, 40, None, None, 50)
+    assert sos is main._cascade_sos(256, 1, 40, None, None, 50)
+    with pytest.raises(ValueError):
+        sos[0, 0] = 0
+    with pytest.raises(ValueError):
+        main._butter_band(256, 1, 40, 4)[0, 0] = 0
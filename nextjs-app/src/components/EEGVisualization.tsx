@@ -31,7 +31,8 @@ interface EEGVisualizationProps {
     duration_sec: number;
     data_shape: [number, number];
     channel_names: string[];
-    preview: number[][];
+    preview?: number[][];
+    data?: number[][];            // /parse omits preview when the full data is inline
   };
   fullData?: number[][];
 }
@@ -53,7 +54,7 @@ export default function EEGVisualization({ eegData, fullData }: EEGVisualization
   useRegisterZoomPlugin();
   const { theme } = useTheme();
 
-  const dataToPlot = fullData && fullData.length > 0 ? fullData : eegData.preview;
+  const dataToPlot = fullData && fullData.length > 0 ? fullData : eegData.preview ?? eegData.data ?? [];
   const sampleCount = dataToPlot[0]?.length || 0;
 
   const [visibleChannels, setVisibleChannels] = useState<boolean[]>(() =>